@@ -1,83 +1,196 @@
 import sqlite3
 import os
+import atexit
+import queue
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
 
 DB_FILE = "chat_history.db"
+POOL_SIZE = 4
+FLUSH_INTERVAL = 0.02     # seconds the writer waits for more messages before a write
+
+# Connections are opened lazily (up to POOL_SIZE) and handed back to the
+# pool after each call instead of being closed, so schema parsing and the
+# per-connection PRAGMA setup only happen once per connection.
+_pool = queue.Queue()
+_pool_lock = threading.Lock()
+_pool_opened = 0
+
+# save_message() only enqueues here and returns; a daemon writer thread
+# inserts whatever has queued up in one transaction. Reads call
+# flush_messages() first, which waits until the queue is written.
+_pending = queue.Queue()
+_writer_lock = threading.Lock()
+_writer = None
+
+def _connect():
+    conn = sqlite3.connect(DB_FILE, check_same_thread=False, isolation_level=None)
+    try:
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute('PRAGMA cache_size=-65536')     # 64 MiB page cache
+        conn.execute('PRAGMA mmap_size=268435456')   # 256 MiB memory map
+    except BaseException:
+        conn.close()
+        raise
+    return conn
+
+def _acquire():
+    global _pool_opened
+    while True:
+        try:
+            return _pool.get_nowait()
+        except queue.Empty:
+            pass
+        with _pool_lock:
+            can_open = _pool_opened < POOL_SIZE
+            if can_open:
+                _pool_opened += 1
+        if can_open:
+            try:
+                return _connect()
+            except BaseException:
+                _discard(None)
+                raise
+        try:
+            # timed, so a waiter notices when a discarded connection frees a slot
+            return _pool.get(timeout=0.1)
+        except queue.Empty:
+            pass
+
+def _discard(conn):
+    global _pool_opened
+    if conn is not None:
+        conn.close()
+    with _pool_lock:
+        _pool_opened -= 1
+
+def _release(conn):
+    if conn.in_transaction:
+        # the caller failed, or its COMMIT did (e.g. SQLITE_BUSY)
+        try:
+            conn.execute('ROLLBACK')
+        except sqlite3.Error:
+            _discard(conn)
+            return
+    _pool.put(conn)
+
+@contextmanager
+def _connection():
+    conn = _acquire()
+    try:
+        yield conn
+    finally:
+        _release(conn)
+
+@contextmanager
+def _transaction():
+    with _connection() as conn:
+        conn.execute('BEGIN')
+        yield conn
+        conn.execute('COMMIT')
 
 def init_db():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS chat (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            codebase_id TEXT,
-            role TEXT,
-            message TEXT,
-            timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS codebases (
-            id TEXT PRIMARY KEY,
-            name TEXT,
-            path TEXT,
-            created_at DATETIME DEFAULT CURRENT_TIMESTAMP
-        )
-    ''')
-    conn.commit()
-    conn.close()
-    
+    with _transaction() as conn:
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS chat (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                codebase_id TEXT,
+                role TEXT,
+                message TEXT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS codebases (
+                id TEXT PRIMARY KEY,
+                name TEXT,
+                path TEXT,
+                created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_chat_codebase_ts ON chat(codebase_id, timestamp)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_codebases_created ON codebases(created_at DESC)')
+    # journal_mode is persistent in the database file, so once is enough
+    with _connection() as conn:
+        conn.execute('PRAGMA journal_mode=WAL')
+
 def register_codebase(codebase_id, name, path):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('''
-        INSERT OR IGNORE INTO codebases (id, name, path)
-        VALUES (?, ?, ?)
-    ''', (codebase_id, name, path))
-    conn.commit()
-    conn.close()
+    with _connection() as conn:
+        conn.execute('''
+            INSERT OR IGNORE INTO codebases (id, name, path)
+            VALUES (?, ?, ?)
+        ''', (codebase_id, name, path))
 
 def list_codebases():
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('SELECT id, name, path FROM codebases ORDER BY created_at DESC')
-    result = c.fetchall()
-    conn.close()
-    return result
+    with _connection() as conn:
+        return conn.execute('SELECT id, name, path FROM codebases ORDER BY created_at DESC').fetchall()
 
 def delete_codebase(codebase_id):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('DELETE FROM chat WHERE codebase_id=?', (codebase_id,))
-    c.execute('DELETE FROM codebases WHERE id=?', (codebase_id,))
-    conn.commit()
-    conn.close()
+    flush_messages()
+    with _transaction() as conn:
+        conn.execute('DELETE FROM chat WHERE codebase_id=?', (codebase_id,))
+        conn.execute('DELETE FROM codebases WHERE id=?', (codebase_id,))
+
+def save_messages(codebase_id, pairs):
+    _insert_messages([(codebase_id, role, message) for role, message in pairs])
 
 def save_message(codebase_id, role, message):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('''
-        INSERT INTO chat (codebase_id, role, message)
-        VALUES (?, ?, ?)
-    ''', (codebase_id, role, message))
-    conn.commit()
-    conn.close()
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = threading.Thread(target=_write_messages, name="chat-writer", daemon=True)
+                _writer.start()
+    _pending.put((codebase_id, role, message))
+
+def _write_messages():
+    while True:
+        rows = [_pending.get()]
+        time.sleep(FLUSH_INTERVAL)    # a chat turn's question and answer share one write
+        try:
+            while True:
+                rows.append(_pending.get_nowait())
+        except queue.Empty:
+            pass
+        try:
+            _insert_messages(rows)
+        except Exception:
+            # keep the rows that are fine; only the failing ones are lost
+            for row in rows:
+                try:
+                    _insert_messages([row])
+                except Exception as e:
+                    print(f"Failed to save chat message for {row[0]}: {e}")
+        finally:
+            for _ in rows:
+                _pending.task_done()
+
+def _insert_messages(rows):
+    with _transaction() as conn:
+        conn.executemany('''
+            INSERT INTO chat (codebase_id, role, message)
+            VALUES (?, ?, ?)
+        ''', rows)
+
+def flush_messages():
+    """Block until every message passed to save_message() is written."""
+    _pending.join()
+
+atexit.register(flush_messages)
 
 def get_chat_history(codebase_id):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('''
-        SELECT role, message, timestamp FROM chat
-        WHERE codebase_id = ?
-        ORDER BY timestamp ASC
-    ''', (codebase_id,))
-    history = c.fetchall()
-    conn.close()
-    return history
+    flush_messages()
+    with _connection() as conn:
+        return conn.execute('''
+            SELECT role, message, timestamp FROM chat
+            WHERE codebase_id = ?
+            ORDER BY timestamp ASC
+        ''', (codebase_id,)).fetchall()
 
 def clear_chat_history(codebase_id):
-    conn = sqlite3.connect(DB_FILE)
-    c = conn.cursor()
-    c.execute('DELETE FROM chat WHERE codebase_id = ?', (codebase_id,))
-    conn.commit()
-    conn.close()
+    flush_messages()
+    with _connection() as conn:
+        conn.execute('DELETE FROM chat WHERE codebase_id = ?', (codebase_id,))
@@ -1,7 +1,37 @@
 import os
+import sys
 import ast
-import networkx as nx
+import gzip
+import pickle
+import hashlib
 import builtins
+import tempfile
+from array import array
+from collections import defaultdict, deque
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from fast_graph import FastGraph
+
+# Below this many files the process pool costs more than it saves.
+PARALLEL_MIN_FILES = 64
+
+# Directories that never hold the project's own code (VCS metadata,
+# virtualenvs, caches, build output); they are not descended into.
+SKIP_DIRS = frozenset({
+    ".git", ".hg", ".svn", ".venv", "venv", "node_modules", "__pycache__",
+    ".mypy_cache", ".pytest_cache", ".tox", ".nox", "build", "dist",
+})
+
+# Per-file summaries are cached here, keyed by path, mtime and size, so
+# unchanged files are not parsed again. Bump INDEX_CACHE_VERSION whenever
+# the summary format (see _index_file) changes.
+INDEX_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "code-navigator")
+INDEX_CACHE_VERSION = 1
+
+# Calls to these are never linked, even if a repo function shadows one.
+BUILTIN_NAMES = frozenset(dir(builtins))
 
 class CodeParser:
     """
@@ -15,152 +45,169 @@ class CodeParser:
         - calls (function → function)
     """
 
-    def __init__(self, repo_path):
+    def __init__(self, repo_path, cache_dir=INDEX_CACHE_DIR, exclude_dirs=()):
         self.repo_path = repo_path
-        self.graph = nx.DiGraph()
+        self.exclude_dirs = exclude_dirs      # directories left out of the walk, by path
+        self.cache_dir = cache_dir            # None disables the summary cache
+        self.graph = FastGraph()
         self.repo_files = []                  # list of .py files (rel paths)
-        self.functions_by_file = {}           # file -> {func_name: ast.FunctionDef}
+        self._paths = []                      # absolute path of each repo file, same order
+        self._by_basename = defaultdict(list) # "name.py" -> [rel paths]
+        self._uid_cache = {}                  # (part, ...) -> interned UID
+        self._defined_vars = defaultdict(set) # context uid -> defined variable names
+        self._var_updates = defaultdict(dict) # var name -> {(context, var uid): label}
+        self._name_resolver = {}              # file -> {called name: callee uid}
+        self._attr_resolver = {}              # file -> {module alias: matched file}
+        self._edges = []                      # (u, v, attrs) queued by the current phase
+        self._call_edges = []                 # resolved (caller, callee, attrs), checked once all nodes exist
+        self.functions_by_file = {}           # file -> {func_name: function summary}
+        self.classes_by_file = {}             # file -> [class summary]
         self.imports_by_file = {}             # file -> alias -> module
         self.from_imports_by_file = {}        # file -> name -> module
-        self.builtin_names = set(dir(builtins))
+        self.classes_by_name = defaultdict(list)  # class name -> [class uid]
+        self.class_bases = {}                 # (file, class name) -> [base names]
 
     # ----------------------------------------------------------
     def parse(self):
         """Main entry point to build the full graph."""
         self._collect_files()
         self._index_functions_and_imports()
+        self._build_resolvers()
         self._add_function_nodes_and_import_edges()
+        self._flush_edges()
         self._add_class_nodes_and_edges()
-        self._resolve_function_calls()
+        self._flush_edges()
+        self._add_call_edges()
         
-        self.crossrefs = {
-        "calls": self._group_edges_by_label("calls"),
-        "inherits": self._group_edges_by_label("inherits"),
-        "defines_var": self._group_edges_by_label("defines_var"),
-        "uses_var": self._group_edges_by_label("uses_var"),
-        }
+        self.crossrefs = _CrossrefsLazy(self.graph)
+        self._build_adjacency()
         return self.graph
 
+    # ----------------------------------------------------------
+    def _uid(self, *parts):
+        """Build the "part::part[::part]" UID once; equal UIDs share one interned str."""
+        uid = self._uid_cache.get(parts)
+        if uid is None:
+            uid = self._uid_cache[parts] = sys.intern("::".join(parts))
+        return uid
+
+    def _flush_edges(self):
+        """Insert the edges queued by a phase with one add_edges_from call.
+
+        Phases only queue edges; nodes are still added immediately, so
+        has_node() checks inside a phase see the same graph as before.
+        """
+        self.graph.add_edges_from(self._edges)
+        self._edges.clear()
+
     # ----------------------------------------------------------
     def _collect_files(self):
-        """Walk repo and collect all .py files."""
-        for root, _, files in os.walk(self.repo_path):
-            for file in files:
-                if file.endswith(".py"):
-                    full_path = os.path.join(root, file)
-                    rel_path = os.path.relpath(full_path, self.repo_path)
-                    self.repo_files.append(rel_path)
-                    self.graph.add_node(rel_path, type="file", display_name=rel_path)
+        """Walk repo and collect all .py files; reading them is left to _index_file."""
+        for entry, rel_path in scan_py_files(self.repo_path, self.exclude_dirs):
+            # rel paths key every per-file dict and prefix every UID
+            rel_path = sys.intern(rel_path)
+            self.repo_files.append(rel_path)
+            self._paths.append(entry.path)
+            self._by_basename[entry.name].append(rel_path)
+        self.graph.add_nodes_from(
+            (rel_path, {"type": "file", "display_name": rel_path}) for rel_path in self.repo_files
+        )
 
     # ----------------------------------------------------------
     def _index_functions_and_imports(self):
-        """Parse AST for each file, record functions and imports."""
-        for rel in self.repo_files:
-            full = os.path.join(self.repo_path, rel)
+        """Parse AST for each file (cached summaries reused), record functions, classes and imports."""
+        results = dict.fromkeys(self.repo_files)
+        cache_paths = {}
+        if self.cache_dir:
+            for rel, path in zip(self.repo_files, self._paths):
+                cache_path = _index_cache_path(self.cache_dir, path)
+                if cache_path:
+                    results[rel] = _load_cached_summary(cache_path)
+                    cache_paths[rel] = cache_path
+
+        rels = [rel for rel, result in results.items() if result is None]
+        paths = [path for rel, path in zip(self.repo_files, self._paths) if results[rel] is None]
+        parsed = None
+        if len(rels) >= PARALLEL_MIN_FILES and (os.cpu_count() or 1) > 1:
             try:
-                with open(full, "r", encoding="utf-8") as f:
-                    src = f.read()
-                tree = ast.parse(src)
-            except Exception as e:
-                print(f"Failed to parse {rel}: {e}")
+                with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+                    parsed = list(executor.map(_index_file, rels, paths, chunksize=16))
+            except (OSError, BrokenProcessPool) as e:
+                print(f"Parallel parsing unavailable, falling back to serial: {e}")
+        if parsed is None:
+            parsed = map(_index_file, rels, paths)
+        for rel, result in zip(rels, parsed):
+            results[rel] = result
+            if not result[1] and rel in cache_paths:
+                if not _store_summary(cache_paths[rel], result):
+                    cache_paths.clear()       # unwritable cache: stop trying for this run
+
+        for rel, (summary, error) in results.items():
+            if error:
+                print(error)
                 continue
 
-            self.functions_by_file[rel] = {}
-            self.imports_by_file[rel] = {}
-            self.from_imports_by_file[rel] = {}
-
-            for node in tree.body:
-                # record function definitions
-                if isinstance(node, ast.FunctionDef):
-                    self.functions_by_file[rel][node.name] = node
-
-                # record `import module as alias`
-                elif isinstance(node, ast.Import):
-                    for alias in node.names:
-                        mod = alias.name.split('.')[0]
-                        asname = alias.asname or mod
-                        self.imports_by_file[rel][asname] = mod
-
-                # record `from module import name as alias`
-                elif isinstance(node, ast.ImportFrom):
-                    if node.module:
-                        mod = node.module.split('.')[0]
-                        for alias in node.names:
-                            asname = alias.asname or alias.name
-                            self.from_imports_by_file[rel][asname] = mod
-                            
+            self.functions_by_file[rel] = summary["functions"]
+            self.classes_by_file[rel] = summary["classes"]
+            self.imports_by_file[rel] = summary["imports"]
+            self.from_imports_by_file[rel] = summary["from_imports"]
+
     def _add_class_nodes_and_edges(self):
         """Add class nodes, their methods, and inheritance relationships."""
-        for rel in self.repo_files:
-            with open(os.path.join(self.repo_path, rel), "r", encoding="utf-8") as f:
-                tree = ast.parse(f.read(), filename=rel)
-
-            for node in ast.walk(tree):
-                if isinstance(node, ast.ClassDef):
-                    class_name = node.name
-                    class_uid = f"{rel}::{class_name}"
-                    doc = ast.get_docstring(node) or ""
-                    start = getattr(node, "lineno", 0)
-                    end = getattr(node, "end_lineno", start)
-                    loc = end - start + 1
-                    bases = [getattr(b, "id", getattr(b, "attr", "")) for b in node.bases]
-
-                    # --- Add class node ---
+        for rel, classes in self.classes_by_file.items():
+            for cls in classes:
+                class_name = cls["name"]
+                class_uid = self._uid(rel, class_name)
+                bases = cls["bases"]
+
+                # --- Add class node ---
+                self.graph.add_node(
+                    class_uid,
+                    type="class",
+                    display_name=class_name,
+                    file=rel,
+                    loc=cls["loc"],
+                    bases=bases,
+                    doc=cls["doc"],
+                )
+
+                if class_uid not in self.classes_by_name[class_name]:
+                    self.classes_by_name[class_name].append(class_uid)
+                self.class_bases[(rel, class_name)] = bases
+
+                # --- Link: file → class ---
+                self._edges.append((rel, class_uid, {"label": "defined_in"}))
+
+                # --- Link: subclass → baseclass (if base exists) ---
+                for base in bases:
+                    # Find if base class exists in same repo
+                    for existing_uid in self.classes_by_name.get(base, ()):
+                        self._edges.append((class_uid, existing_uid, {"label": "inherits"}))
+                            
+                # --- Add method nodes and edges: class → method ---
+                for method in cls["methods"]:
+                    func_uid = self._uid(rel, class_name, method['name'])
+                    display = f"{method['name']}()"
+
+                    # --- Add method node ---
                     self.graph.add_node(
-                        class_uid,
-                        type="class",
-                        display_name=class_name,
+                        func_uid,
+                        type="function",
+                        display_name=display,
                         file=rel,
-                        loc=loc,
-                        bases=bases,
-                        doc=doc,
+                        class_name=class_name,
+                        loc=method["loc"],
+                        params=method["params"],
+                        doc=method["doc"],
                     )
+                    
+                    # --- Edge: class → method ---
+                    self._edges.append((class_uid, func_uid, {"label": "has_method"}))
 
-                    # --- Link: file → class ---
-                    self.graph.add_edge(rel, class_uid, label="defined_in")
-
-                    # --- Link: subclass → baseclass (if base exists) ---
-                    for base in bases:
-                        # Find if base class exists in same repo
-                        for existing_node, attrs in self.graph.nodes(data=True):
-                            if attrs.get("type") == "class" and attrs.get("display_name") == base:
-                                self.graph.add_edge(class_uid, existing_node, label="inherits")
-                                
-                    # --- Add method nodes and edges: class → method ---
-                    for child in node.body:
-                        if isinstance(child, ast.FunctionDef):
-                            func_uid = f"{rel}::{class_name}::{child.name}"
-                            display = f"{child.name}()"
-                            start = getattr(child, "lineno", 0)
-                            end = getattr(child, "end_lineno", start)
-                            loc = end - start + 1
-                            params = [a.arg for a in child.args.args]
-                            doc = ast.get_docstring(child) or ""
-
-                            # --- Add method node ---
-                            self.graph.add_node(
-                                func_uid,
-                                type="function",
-                                display_name=display,
-                                file=rel,
-                                class_name=class_name,
-                                loc=loc,
-                                params=params,
-                                doc=doc,
-                            )
-                            
-                            # --- Edge: class → method ---
-                            self.graph.add_edge(class_uid, func_uid, label="has_method")
-
-                            self._track_variables(child, rel)
-                            self._track_types(child, func_uid)
-                            self._track_method_calls(child, class_uid, func_uid)
-                        '''# --- Link: class → its methods ---
-                        for child in node.body:
-                            if isinstance(child, ast.FunctionDef):
-                                func_uid = f"{rel}::{child.name}"
-                                if func_uid in self.graph.nodes:
-                                    self.graph.add_edge(class_uid, func_uid, label="has_method")'''
+                    self._track_variables(method["var_events"], rel)
+                    self._track_types(method, func_uid)
+                    self._track_method_calls(method["self_calls"], class_uid, func_uid)
+                    self._resolve_function_calls(method["calls"], rel, func_uid, class_name)
 
 
     # ----------------------------------------------------------
@@ -172,130 +219,115 @@ class CodeParser:
 
             # Add function nodes and link to file
             # inside _add_function_nodes_and_import_edges()
-            for fname, fnode in funcs.items():
-                uid = f"{rel}::{fname}"
+            for fname, func in funcs.items():
+                uid = self._uid(rel, fname)
                 display = f"{fname}()"
-                start = getattr(fnode, "lineno", 0)
-                end = getattr(fnode, "end_lineno", start)
-                loc = end - start + 1
-                params = [a.arg for a in fnode.args.args]
-                doc = ast.get_docstring(fnode) or ""
 
                 self.graph.add_node(uid, type="function", display_name=display,
-                                    file=rel, loc=loc, params=params, doc=doc)
+                                    file=rel, loc=func["loc"], params=func["params"],
+                                    doc=func["doc"])
 
                 # change direction: file → function
-                self.graph.add_edge(rel, uid, label="defined_in")
+                self._edges.append((rel, uid, {"label": "defined_in"}))
                 
-                self._track_variables(fnode, rel)
-                self._track_types(fnode, uid)
+                self._track_variables(func["var_events"], rel)
+                self._track_types(func, uid)
+                self._resolve_function_calls(func["calls"], rel, uid)
 
-                # Add edges for imports that match repo files
-                for alias, module in self.imports_by_file.get(rel, {}).items():
-                    self._add_import_edge(rel, module)
-
-                for name, module in self.from_imports_by_file.get(rel, {}).items():
-                    self._add_import_edge(rel, module)
+            # Add edges for imports that match repo files (once per module);
+            # several aliases or names often come from the same module
+            modules = dict.fromkeys(self.imports_by_file.get(rel, {}).values())
+            modules.update(dict.fromkeys(self.from_imports_by_file.get(rel, {}).values()))
+            for module in modules:
+                self._add_import_edge(rel, module)
 
     # ----------------------------------------------------------
     def _add_import_edge(self, src_file, module_name):
         """Link file → file if module_name matches repo file."""
-        candidate = module_name + ".py"
-        for f in self.repo_files:
-            if os.path.basename(f) == candidate:
-                self.graph.add_edge(src_file, f, label="file_import")
+        for f in self._by_basename.get(module_name + ".py", ()):
+            self._edges.append((src_file, f, {"label": "file_import"}))
 
     # ----------------------------------------------------------
-    def _resolve_function_calls(self):
-        """Walk all function bodies, add call edges."""
-        for rel, funcs in self.functions_by_file.items():
-            for fname, fnode in funcs.items():
-                caller_uid = f"{rel}::{fname}"  # top-level functions
-
-                for node in ast.walk(fnode):
-                    if not isinstance(node, ast.Call):
-                        continue
-
-                    callee_uid = self._resolve_callee(node, rel, caller_uid)
-                    if callee_uid and self.graph.has_node(callee_uid):
-                        self.graph.add_edge(caller_uid, callee_uid, label="calls")
-
-        # --- Also handle class methods ---
-        for rel in self.repo_files:
-            with open(os.path.join(self.repo_path, rel), "r", encoding="utf-8") as f:
-                tree = ast.parse(f.read(), filename=rel)
-
-            for node in ast.walk(tree):
-                if isinstance(node, ast.ClassDef):
-                    class_name = node.name
-                    for child in node.body:
-                        if isinstance(child, ast.FunctionDef):
-                            caller_uid = f"{rel}::{class_name}::{child.name}"
-                            for n in ast.walk(child):
-                                if isinstance(n, ast.Call):
-                                    callee_uid = self._resolve_callee(n, rel, caller_uid, class_name)
-                                    if callee_uid and self.graph.has_node(callee_uid):
-                                        self.graph.add_edge(caller_uid, callee_uid, label="calls")
+    def _resolve_function_calls(self, calls, rel, caller_uid, current_class=None):
+        """Resolve one function's call sites while its node is being added.
+
+        The callee may not be in the graph yet, so the edge is only queued;
+        _add_call_edges() keeps the ones whose callee exists in the end.
+        """
+        # Bare-name calls are the bulk of all call sites; the file's name
+        # resolver already holds every name that can resolve, so they cost
+        # one probe here instead of a _resolve_callee() call each.
+        names = self._name_resolver[rel]
+        queue = self._call_edges.append
+        attrs = {"label": "calls"}            # copied by add_edges_from
+        seen = set()                          # foo() and mod.foo() may be one callee
+        for call in calls:
+            if call[0] == "name":
+                callee_uid = names.get(call[1])
+            else:
+                callee_uid = self._resolve_callee(call, rel, caller_uid, current_class)
+            if callee_uid and callee_uid not in seen:
+                seen.add(callee_uid)
+                queue((caller_uid, callee_uid, attrs))
+
+    def _add_call_edges(self):
+        """Add the queued call edges whose callee is a node of the finished graph."""
+        has_node = self.graph.has_node
+        self.graph.add_edges_from(e for e in self._call_edges if has_node(e[1]))
+        self._call_edges.clear()
 
     # ----------------------------------------------------------
-    def _resolve_callee(self, node, rel, caller_uid = None, current_class = None):
-        """Try to resolve a call node to an existing function UID in the repo."""
-        # Case 1: foo()F
-        if isinstance(node.func, ast.Name):
-            name = node.func.id
-            if name in self.builtin_names:
-                return None
-            # same file top-level function
-            if name in self.functions_by_file.get(rel, {}):
-                return f"{rel}::{name}"
-            # from-imported function
-            elif name in self.from_imports_by_file.get(rel, {}):
-                mod = self.from_imports_by_file[rel][name]
+    def _build_resolvers(self):
+        """Precompute, per file, what each bare name and module alias resolves to."""
+        for rel, funcs in self.functions_by_file.items():
+            names = {}
+            # from-imported functions; same-file functions take precedence
+            for name, mod in self.from_imports_by_file[rel].items():
                 matched = self._match_module_to_file(mod)
                 if matched:
-                    return f"{matched}::{name}"
-            return None
+                    names[name] = self._uid(matched, name)
+            for name in funcs:
+                names[name] = self._uid(rel, name)
+            for name in BUILTIN_NAMES.intersection(names):
+                del names[name]
+            self._name_resolver[rel] = names
+
+            self._attr_resolver[rel] = {
+                alias: matched
+                for alias, mod in self.imports_by_file[rel].items()
+                if (matched := self._match_module_to_file(mod))
+            }
+
+    # ----------------------------------------------------------
+    def _resolve_callee(self, call, rel, caller_uid = None, current_class = None):
+        """Try to resolve a call site (see _FusedVisitor) to an existing function UID in the repo."""
+        kind = call[0]
+        # Case 1: foo()F
+        if kind == "name":
+            # same-file or from-imported function (never a builtin)
+            return self._name_resolver[rel].get(call[1])
 
         # Case 2: module.func()
-        elif isinstance(node.func, ast.Attribute) and isinstance(node.func.value, ast.Name):
-            owner = node.func.value.id
-            attr = node.func.attr
+        elif kind == "attr":
             # imported module?
-            mapped_mod = self.imports_by_file.get(rel, {}).get(owner)
-            if mapped_mod:
-                matched = self._match_module_to_file(mapped_mod)
-                if matched:
-                    return f"{matched}::{attr}"
-
-        # Case 3: self.method() or super().method()
-        elif isinstance(node.func, ast.Attribute) and isinstance(node.func.value, ast.Name):
-            val = node.func.value.id
-            attr = node.func.attr
-            if val == "self" and current_class:
-                candidate = f"{rel}::{current_class}::{attr}"
-                if self.graph.has_node(candidate):
-                    return candidate
-            elif val == "super" and current_class:
-                # find base class
-                bases = [
-                    a.get("display_name")
-                    for n, a in self.graph.nodes(data=True)
-                    if n == f"{rel}::{current_class}"
-                ]
-                if bases:
-                    base_class_name = bases[0]  # assume single inheritance
-                    candidate = f"{rel}::{base_class_name}::{attr}"
-                    if self.graph.has_node(candidate):
-                        return candidate
+            matched = self._attr_resolver[rel].get(call[1])
+            if matched:
+                return self._uid(matched, call[2])
+
+        # Case 3: super().method()
+        # (self.method() calls are linked by _track_method_calls)
+        elif kind == "super" and current_class:
+            attr = call[1]
+            bases = self.class_bases.get((rel, current_class))
+            if bases:
+                base_class_name = bases[0]  # assume single inheritance
+                return self._uid(rel, base_class_name, attr)
         return None
     # ----------------------------------------------------------
     def _match_module_to_file(self, module_name):
         """Find the repo file corresponding to a module name."""
-        candidate = module_name + ".py"
-        for f in self.repo_files:
-            if os.path.basename(f) == candidate:
-                return f
-        return None
+        matches = self._by_basename.get(module_name + ".py")
+        return matches[0] if matches else None
     #------------------------------------------------------------
     '''def _track_variables(self, node, file_rel):
         """Add variable definition, usage, and mutation edges."""
@@ -346,97 +378,476 @@ class CodeParser:
                         if callee_uid in self.graph.nodes:
                             self.graph.add_edge(current_func_uid, callee_uid, label="calls_method")'''
                             
-    def _track_variables(self, node, context_uid):
-        for subnode in ast.walk(node):
-            # --- Definitions ---
-            if isinstance(subnode, ast.Assign):
-                for target in subnode.targets:
-                    if isinstance(target, ast.Name):
-                        var_name = target.id
-                        var_uid = f"{context_uid}::{var_name}"
-                        self.graph.add_node(var_uid, type="variable", display_name=var_name)
-                        self.graph.add_edge(context_uid, var_uid, label="defines_var")
-
-            # --- Mutations (+=, -=, etc.) ---
-            elif isinstance(subnode, ast.AugAssign):
-                if isinstance(subnode.target, ast.Name):
-                    var_name = subnode.target.id
-                    var_uid = f"{context_uid}::{var_name}"
+    def _track_variables(self, var_events, context_uid):
+        defined = self._defined_vars[context_uid]
+        for kind, var_name in var_events:
+            # --- Usages (only of variables already defined in this context) ---
+            if kind == "uses_var":
+                if var_name in defined:
+                    self._edges.append((self._uid(context_uid, var_name), context_uid, {"label": "uses_var"}))
+
+            # --- Definitions / mutations (+=, -=, etc.) ---
+            else:
+                var_uid = self._uid(context_uid, var_name)
+                if var_name not in defined:
+                    defined.add(var_name)
                     self.graph.add_node(var_uid, type="variable", display_name=var_name)
-                    self.graph.add_edge(context_uid, var_uid, label="mutates_var")
-
-            # --- Usages ---
-            elif isinstance(subnode, ast.Name):
-                if isinstance(subnode.ctx, ast.Load):
-                    var_name = subnode.id
-                    var_uid = f"{context_uid}::{var_name}"
-                    if self.graph.has_node(var_uid):
-                        self.graph.add_edge(var_uid, context_uid, label="uses_var")
+                self._edges.append((context_uid, var_uid, {"label": kind}))
+                self._var_updates[var_name][(context_uid, var_uid)] = kind
 
 
-    def _track_types(self, node, func_uid):
-        if not isinstance(node, ast.FunctionDef):
-            return
-
+    def _track_types(self, func, func_uid):
         # Parameter types
-        for arg in node.args.args:
-            if arg.annotation:
-                type_name = self._get_type_name(arg.annotation)
-                self.graph.add_node(type_name, type="type", display_name=type_name)
-                self.graph.add_edge(func_uid, type_name, label="param_type")
+        for type_name in func["param_types"]:
+            self.graph.add_node(type_name, type="type", display_name=type_name)
+            self._edges.append((func_uid, type_name, {"label": "param_type"}))
 
         # Return type
-        if node.returns:
-            type_name = self._get_type_name(node.returns)
+        if func["return_type"]:
+            type_name = func["return_type"]
             self.graph.add_node(type_name, type="type", display_name=type_name)
-            self.graph.add_edge(func_uid, type_name, label="return_type")
-
-    def _get_type_name(self, ann):
-        if isinstance(ann, ast.Name):
-            return ann.id
-        elif isinstance(ann, ast.Subscript):
-            base = self._get_type_name(ann.value)
-            sub = self._get_type_name(ann.slice)
-            return f"{base}[{sub}]"
-        elif isinstance(ann, ast.Attribute):
-            return f"{ann.value.id}.{ann.attr}" if isinstance(ann.value, ast.Name) else ann.attr
-        else:
-            return ast.unparse(ann) if hasattr(ast, "unparse") else str(ann)
-
-
-    def _track_method_calls(self, node, class_uid, func_uid):
-        for subnode in ast.walk(node):
-            if isinstance(subnode, ast.Call) and isinstance(subnode.func, ast.Attribute):
-                if isinstance(subnode.func.value, ast.Name) and subnode.func.value.id in {"self", "super"}:
-                    called_name = subnode.func.attr
-                    called_uid = f"{class_uid}::{called_name}"
-                    if self.graph.has_node(called_uid):
-                        self.graph.add_edge(func_uid, called_uid, label="calls")
-
-    def _group_edges_by_label(self, label):
-        edges = {}
+            self._edges.append((func_uid, type_name, {"label": "return_type"}))
+
+
+    def _track_method_calls(self, self_calls, class_uid, func_uid):
+        for called_name in self_calls:
+            called_uid = self._uid(class_uid, called_name)
+            if self.graph.has_node(called_uid):
+                self._edges.append((func_uid, called_uid, {"label": "calls"}))
+
+    def _build_adjacency(self):
+        """Freeze the finished graph's edges into CSR arrays keyed by int node ids.
+
+        Node i's out-edges are _adj_dst[_adj_indptr[i]:_adj_indptr[i + 1]],
+        with the matching labels in _adj_label (ids into _labels). Traversal
+        queries read these compact arrays instead of networkx's nested dicts.
+        """
+        self._ids = {}                        # uid -> node id
+        self._uids = []                       # node id -> uid
+        self._labels = []                     # label id -> label
+        label_ids = {}
+        src, dst, label_id = [], [], []
+        for uid in self.graph.nodes:
+            self._ids[uid] = len(self._uids)
+            self._uids.append(uid)
         for u, v, d in self.graph.edges(data=True):
-            if d.get("label") == label:
-                edges.setdefault(u, []).append(v)
-        return edges
-    
+            label = d.get("label")
+            if label not in label_ids:
+                label_ids[label] = len(self._labels)
+                self._labels.append(label)
+            src.append(self._ids[u])
+            dst.append(self._ids[v])
+            label_id.append(label_ids[label])
+
+        # counting sort by source node; stable, so per-node edge order is kept
+        indptr = array("l", [0]) * (len(self._uids) + 1)
+        for u in src:
+            indptr[u + 1] += 1
+        for i in range(len(self._uids)):
+            indptr[i + 1] += indptr[i]
+        fill = array("l", indptr[:-1])
+        order = array("l", [0]) * len(src)
+        for e, u in enumerate(src):
+            order[fill[u]] = e
+            fill[u] += 1
+
+        self._adj_indptr = indptr
+        self._adj_dst = array("l", (dst[e] for e in order))
+        self._adj_label = array("l", (label_id[e] for e in order))
+
+    def out_edges(self, uid, label=None):
+        """[(uid, target, label)] for the out-edges of uid, optionally of one label."""
+        u = self._ids.get(uid)
+        if u is None:
+            return []
+        lo, hi = self._adj_indptr[u], self._adj_indptr[u + 1]
+        uids, labels = self._uids, self._labels
+        return [
+            (uid, uids[v], labels[l])
+            for v, l in zip(self._adj_dst[lo:hi], self._adj_label[lo:hi])
+            if label is None or labels[l] == label
+        ]
+
     def find_variable_updates(self, var_name):
         """Find where a variable is defined or mutated."""
-        results = []
-        for u, v, d in self.graph.edges(data=True):
-            if d.get("label") in {"defines_var", "mutated_in"} and var_name in v:
-                results.append((u, v, d["label"]))
-        return results
+        updates = self._var_updates.get(var_name, {})
+        return [(u, v, label) for (u, v), label in updates.items()]
 
     def find_call_chain(self, func_uid, depth=3):
-        """Find downstream call chain up to given depth."""
+        """Find downstream call chain up to given depth.
+
+        Iterative DFS; each function is expanded at most once, so shared
+        callees (diamonds) and recursion cannot blow up the result.
+        """
         chain = []
-        def dfs(node, level):
+        stack = [(func_uid, 1)]
+        visited = {func_uid}
+        while stack:
+            node, level = stack.pop()
             if level > depth:
-                return
-            for _, callee, d in self.graph.out_edges(node, data=True):
-                if d.get("label") == "calls":
+                continue
+            for _, callee, _ in self.out_edges(node, "calls"):
+                if callee not in visited:
+                    visited.add(callee)
                     chain.append((node, callee))
-                    dfs(callee, level + 1)
-        dfs(func_uid, 1)
-        return chain
\ No newline at end of file
+                    stack.append((callee, level + 1))
+        return chain
+
+
+class _CrossrefsLazy(Mapping):
+    """
+    label -> {source uid: [target uids]} for the crossref labels.
+    Nothing is computed until the first lookup; that lookup buckets
+    every edge by label in a single pass and later lookups reuse it.
+    """
+    LABELS = ("calls", "inherits", "defines_var", "uses_var")
+
+    def __init__(self, graph):
+        self._graph = graph
+        self._by_label = None
+
+    def __getitem__(self, label):
+        if label not in self.LABELS:
+            raise KeyError(label)
+        if self._by_label is None:
+            by_label = defaultdict(dict)
+            for u, v, d in self._graph.edges(data=True):
+                if d.get("label") in self.LABELS:
+                    by_label[d["label"]].setdefault(u, []).append(v)
+            self._by_label = by_label
+        return self._by_label.get(label, {})
+
+    def __iter__(self):
+        return iter(self.LABELS)
+
+    def __len__(self):
+        return len(self.LABELS)
+
+
+def scan_py_files(root, exclude_dirs=()):
+    """Yield (DirEntry, rel path) for every .py file under root, in os.walk order, skipping SKIP_DIRS and exclude_dirs."""
+    exclude_dirs = {os.path.abspath(d) for d in exclude_dirs}
+    stack = [(root, "")]
+    while stack:
+        dir_path, rel_dir = stack.pop()
+        subdirs = []
+        try:
+            it = os.scandir(dir_path)
+        except OSError as e:
+            print(f"Failed to scan {dir_path}: {e}")
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name in SKIP_DIRS:
+                        continue
+                    if exclude_dirs and os.path.abspath(entry.path) in exclude_dirs:
+                        continue
+                    subdirs.append((entry.path, rel_dir + entry.name + os.sep))
+                elif entry.name.endswith(".py") and entry.is_file():
+                    yield entry, rel_dir + entry.name
+        stack.extend(reversed(subdirs))
+
+
+def _index_cache_path(cache_dir, path):
+    """Cache file for path's summary in its current version, or None if it cannot be stat()ed."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    key = f"{INDEX_CACHE_VERSION}:{os.path.abspath(path)}:{st.st_mtime_ns}:{st.st_size}"
+    return os.path.join(cache_dir, hashlib.blake2b(key.encode()).hexdigest() + ".pkl.gz")
+
+
+def _load_cached_summary(cache_path):
+    """The cached (summary, None) pair, or None on a miss or an unreadable entry."""
+    try:
+        with open(cache_path, "rb") as f:
+            return pickle.loads(gzip.decompress(f.read()))
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"Ignoring unreadable index cache entry {cache_path}: {e}")
+        return None
+
+
+def _store_summary(cache_path, result):
+    try:
+        atomic_write(cache_path, gzip.compress(pickle.dumps(result, pickle.HIGHEST_PROTOCOL), compresslevel=1))
+        return True
+    except OSError as e:
+        print(f"Failed to write index cache entry {cache_path}: {e}")
+        return False
+
+
+def atomic_write(path, data):
+    """
+    Write data to path through a temp file and rename, so readers never see
+    a partial file. data is bytes, str, or a callable that writes to the
+    open binary file itself.
+    """
+    dir_path = os.path.dirname(path) or "."
+    os.makedirs(dir_path, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=dir_path, suffix=".tmp")
+    mode, encoding = ("w", "utf-8") if isinstance(data, str) else ("wb", None)
+    try:
+        with os.fdopen(fd, mode, encoding=encoding) as f:
+            if callable(data):
+                data(f)
+            else:
+                f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+# ----------------------------------------------------------
+# Per-file indexing. These run in worker processes, so they only
+# return plain data (dicts, lists, tuples of str), never AST nodes.
+# ----------------------------------------------------------
+def _index_file(rel, path):
+    """Read and parse one file; return (summary, error) with exactly one of them set."""
+    try:
+        with open(path, "rb") as f:
+            src = f.read()
+    except OSError as e:
+        return None, f"Failed to read {rel}: {e}"
+    try:
+        # what ast.parse() does, minus its wrapper; bytes go straight to
+        # the tokenizer, which honours any coding declaration itself
+        tree = compile(src, rel, "exec", ast.PyCF_ONLY_AST)
+    except Exception as e:
+        return None, f"Failed to parse {rel}: {e}"
+
+    functions, imports, from_imports = {}, {}, {}
+    for node in tree.body:
+        # record function definitions
+        if isinstance(node, ast.FunctionDef):
+            functions[node.name] = _summarise_function(node)
+
+        # record `import module as alias`
+        elif isinstance(node, ast.Import):
+            for alias in node.names:
+                mod = alias.name.split('.')[0]
+                asname = alias.asname or mod
+                imports[asname] = mod
+
+        # record `from module import name as alias`
+        elif isinstance(node, ast.ImportFrom):
+            if node.module:
+                mod = node.module.split('.')[0]
+                for alias in node.names:
+                    asname = alias.asname or alias.name
+                    from_imports[asname] = mod
+
+    classes = [_summarise_class(node) for node in _find_classes(tree)]
+    summary = {
+        "functions": functions,
+        "classes": classes,
+        "imports": imports,
+        "from_imports": from_imports,
+    }
+    return summary, None
+
+
+def _find_classes(tree):
+    """
+    Every ClassDef in the tree, in ast.walk (breadth-first) order.
+    A class can only appear in a statement list, so only statements,
+    except handlers and match cases are queued; expressions are skipped.
+    """
+    classes = []
+    queue = deque([tree])
+    while queue:
+        node = queue.popleft()
+        for field in node._fields:
+            value = getattr(node, field, None)
+            if value.__class__ is list:
+                for item in value:
+                    if isinstance(item, _BLOCK_NODES):
+                        if item.__class__ is ast.ClassDef:
+                            classes.append(item)
+                        queue.append(item)
+    return classes
+
+
+_BLOCK_NODES = (ast.stmt, ast.excepthandler, ast.match_case)
+
+
+def _docstring(node):
+    """
+    ast.get_docstring(node, clean=False) minus its type checks. Docs are
+    stored raw; graph_utils.get_doc() cleans the ones that get displayed.
+    """
+    body = node.body
+    if not body or type(body[0]) is not ast.Expr:
+        return ""
+    value = body[0].value
+    if type(value) is not ast.Constant or type(value.value) is not str:
+        return ""
+    return value.value
+
+
+def _loc(node):
+    start = getattr(node, "lineno", 0)
+    end = getattr(node, "end_lineno", start)
+    return end - start + 1
+
+
+def _summarise_class(node):
+    return {
+        "name": node.name,
+        "loc": _loc(node),
+        "bases": [getattr(b, "id", getattr(b, "attr", "")) for b in node.bases],
+        "doc": _docstring(node),
+        "methods": [
+            _summarise_function(child, is_method=True)
+            for child in node.body
+            if isinstance(child, ast.FunctionDef)
+        ],
+    }
+
+
+def _summarise_function(node, is_method=False):
+    visitor = _FusedVisitor()
+    visitor.visit(node)
+    func = {
+        "name": node.name,
+        "loc": _loc(node),
+        "params": [a.arg for a in node.args.args],
+        "doc": _docstring(node),
+        "param_types": [_get_type_name(a.annotation) for a in node.args.args if a.annotation],
+        "return_type": _get_type_name(node.returns) if node.returns else None,
+        "var_events": visitor.var_events,
+        "calls": visitor.calls,
+    }
+    if is_method:
+        func["self_calls"] = visitor.self_calls
+    return func
+
+
+class _FusedVisitor(ast.NodeVisitor):
+    """Collect a function's var_events, calls and self_calls in one pass (nested classes' calls excluded)."""
+
+    __slots__ = ("var_events", "calls", "self_calls", "_class_depth", "_used", "_last_def", "_seen_calls")
+
+    def __init__(self):
+        self.var_events = []
+        self.calls = []
+        self.self_calls = []
+        self._class_depth = 0
+        self._used = set()                    # names used since their last definition
+        self._last_def = {}                   # name -> kind of its last definition
+        self._seen_calls = set()
+
+    # explicit stack: long expression chains would exceed the recursion limit
+    def visit(self, node):
+        stack = [node]
+        pop, push = stack.pop, stack.append
+        while stack:
+            node = pop()
+            if node is None:                  # end of a nested class
+                self._class_depth -= 1
+                continue
+            cls = node.__class__
+            if cls is ast.Name:
+                self.visit_Name(node)
+                continue
+            handler = _FUSED_DISPATCH.get(cls)
+            if handler is not None:
+                handler(self, node)
+            elif cls is ast.ClassDef:
+                self._class_depth += 1
+                push(None)
+            children = []
+            for field in node._fields:
+                value = getattr(node, field, None)
+                if value.__class__ is list:
+                    for item in value:
+                        if isinstance(item, ast.AST):
+                            children.append(item)
+                elif isinstance(value, ast.AST):
+                    children.append(value)
+            stack.extend(reversed(children))
+
+    def visit_Assign(self, node):
+        for target in node.targets:
+            if isinstance(target, ast.Name):
+                self._define("defines_var", target.id)
+
+    def visit_AugAssign(self, node):
+        if isinstance(node.target, ast.Name):
+            self._define("mutates_var", node.target.id)
+
+    def visit_Name(self, node):
+        # a repeated use only matters if the name was (re)defined in between
+        if isinstance(node.ctx, ast.Load) and node.id not in self._used:
+            self._used.add(node.id)
+            self.var_events.append(("uses_var", node.id))
+
+    def _define(self, kind, name):
+        # a repeat of the last definition kind adds no edge; later uses do
+        self._used.discard(name)
+        if self._last_def.get(name) != kind:
+            self._last_def[name] = kind
+            self.var_events.append((kind, name))
+
+    def visit_Call(self, node):
+        if not self._class_depth:
+            self._record_call(node.func)
+
+    def _record_call(self, func):
+        if isinstance(func, ast.Name):
+            self._add_call(("name", func.id))
+        elif isinstance(func, ast.Attribute):
+            if isinstance(func.value, ast.Name):
+                if self._add_call(("attr", func.value.id, func.attr)) and func.value.id in {"self", "super"}:
+                    self.self_calls.append(func.attr)
+            elif (isinstance(func.value, ast.Call) and isinstance(func.value.func, ast.Name)
+                    and func.value.func.id == "super"):
+                self._add_call(("super", func.attr))
+
+    def _add_call(self, call):
+        # a call site repeated in one function resolves to the same edge
+        if call in self._seen_calls:
+            return False
+        self._seen_calls.add(call)
+        self.calls.append(call)
+        return True
+
+
+_FUSED_DISPATCH = {
+    ast.Assign: _FusedVisitor.visit_Assign,
+    ast.AugAssign: _FusedVisitor.visit_AugAssign,
+    ast.Call: _FusedVisitor.visit_Call,
+}
+
+
+def _get_type_name(ann):
+    # The common annotation shapes are rendered directly; ast.unparse is
+    # only the fallback for anything more exotic.
+    kind = type(ann)
+    if kind is ast.Name:
+        return ann.id
+    elif kind is ast.Subscript:
+        base = _get_type_name(ann.value)
+        sub = _get_type_name(ann.slice)
+        return f"{base}[{sub}]"
+    elif kind is ast.Attribute:
+        return f"{ann.value.id}.{ann.attr}" if type(ann.value) is ast.Name else ann.attr
+    elif kind is ast.Constant and ann.value is not Ellipsis:
+        return repr(ann.value)
+    elif kind is ast.BinOp and type(ann.op) is ast.BitOr and _is_plain_type(ann.left) and _is_plain_type(ann.right):
+        return f"{_get_type_name(ann.left)} | {_get_type_name(ann.right)}"
+    elif kind is ast.Tuple and all(type(e) is ast.Name for e in ann.elts):
+        return f"({', '.join(e.id for e in ann.elts)})"
+    else:
+        return ast.unparse(ann) if hasattr(ast, "unparse") else str(ann)
+
+
+def _is_plain_type(ann):
+    return type(ann) is ast.Name or (type(ann) is ast.Constant and ann.value is None)
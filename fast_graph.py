@@ -0,0 +1,162 @@
+from array import array
+from collections.abc import Mapping
+
+
+class FastGraph:
+    """
+    Directed graph with the part of the networkx.DiGraph API that the
+    parser, the query code and the pyvis layers use:
+        add_node / add_nodes_from / add_edge / add_edges_from
+        has_node, nodes (iterable, subscriptable, nodes(data=True))
+        edges(data=...), out_edges / in_edges, successors / predecessors
+    Storage is the same dict-of-dicts layout networkx uses
+    (node -> {neighbour: edge attrs}), without its view objects and
+    per-call argument handling. Like DiGraph, adding an edge twice keeps
+    one edge and updates its attributes.
+    """
+
+    def __init__(self):
+        self._node = {}                       # node -> attrs
+        self._succ = {}                       # node -> {successor: edge attrs}
+        self._pred = {}                       # node -> {predecessor: edge attrs}
+        self.nodes = _NodeView(self._node)
+
+    # Pickled as (node attrs, src, dst, attr ids, edge attr table, pred
+    # order): edges become int arrays indexing into the node order plus a
+    # table of the distinct edge attr dicts (in practice one per label),
+    # instead of two nested dicts that repeat every node id and attr dict.
+    # pred order lists the edges as _pred holds them, so predecessors keep
+    # their insertion order after a reload.
+    def __getstate__(self):
+        index = {node: i for i, node in enumerate(self._node)}
+        src, dst, attr_ids = array("I"), array("I"), array("I")
+        edge_index = {}
+        table = {}
+        for u, nbrs in self._succ.items():
+            ui = index[u]
+            for v, data in nbrs.items():
+                key = tuple(data.items())
+                attr_id = table.get(key)
+                if attr_id is None:
+                    attr_id = table[key] = len(table)
+                edge_index[u, v] = len(src)
+                src.append(ui)
+                dst.append(index[v])
+                attr_ids.append(attr_id)
+        pred_order = array("I", [edge_index[u, v] for v, nbrs in self._pred.items() for u in nbrs])
+        return self._node, src, dst, attr_ids, list(table), pred_order
+
+    def __setstate__(self, state):
+        if len(state) == 3:                   # caches written before the compact format
+            self._node, self._succ, self._pred = state
+        else:
+            self._node, src, dst, attr_ids, table, pred_order = state
+            nodes = list(self._node)
+            succ = self._succ = {node: {} for node in nodes}
+            pred = self._pred = {node: {} for node in nodes}
+            table = [dict(items) for items in table]
+            edges = []
+            for ui, vi, attr_id in zip(src, dst, attr_ids):
+                data = succ[nodes[ui]][nodes[vi]] = table[attr_id].copy()
+                edges.append(data)
+            for i in pred_order:
+                pred[nodes[dst[i]]][nodes[src[i]]] = edges[i]
+        self.nodes = _NodeView(self._node)
+
+    # ----------------------------------------------------------
+    def add_node(self, node, **attrs):
+        if node in self._node:
+            self._node[node].update(attrs)
+        else:
+            self._node[node] = attrs
+            self._succ[node] = {}
+            self._pred[node] = {}
+
+    def add_nodes_from(self, nodes):
+        """Add nodes given as ids or (id, attrs) pairs."""
+        for item in nodes:
+            if item.__class__ is tuple:
+                self.add_node(item[0], **item[1])
+            else:
+                self.add_node(item)
+
+    def add_edge(self, u, v, **attrs):
+        self._add_edge(u, v, attrs)
+
+    def add_edges_from(self, edges):
+        """Add edges given as (u, v) or (u, v, attrs) tuples."""
+        add = self._add_edge
+        for edge in edges:
+            add(edge[0], edge[1], edge[2] if len(edge) == 3 else {})
+
+    def _add_edge(self, u, v, attrs):
+        succ = self._succ
+        if u not in succ:
+            self.add_node(u)
+        if v not in succ:
+            self.add_node(v)
+        data = succ[u].get(v)
+        if data is None:
+            data = succ[u][v] = self._pred[v][u] = dict(attrs)
+        else:
+            data.update(attrs)
+
+    # ----------------------------------------------------------
+    def has_node(self, node):
+        return node in self._node
+
+    def __contains__(self, node):
+        return node in self._node
+
+    def __iter__(self):
+        return iter(self._node)
+
+    def __len__(self):
+        return len(self._node)
+
+    def number_of_nodes(self):
+        return len(self._node)
+
+    def number_of_edges(self):
+        return sum(map(len, self._succ.values()))
+
+    def successors(self, node):
+        return iter(self._succ[node])
+
+    def predecessors(self, node):
+        return iter(self._pred[node])
+
+    def edges(self, data=False):
+        for u, nbrs in self._succ.items():
+            for v, d in nbrs.items():
+                yield (u, v, d) if data else (u, v)
+
+    def out_edges(self, node, data=False):
+        return [(node, v, d) if data else (node, v) for v, d in self._succ[node].items()]
+
+    def in_edges(self, node, data=False):
+        return [(u, node, d) if data else (u, node) for u, d in self._pred[node].items()]
+
+
+class _NodeView(Mapping):
+    """graph.nodes: node -> attrs; graph.nodes(data=True) yields (node, attrs)."""
+
+    __slots__ = ("_node",)
+
+    def __init__(self, node):
+        self._node = node
+
+    def __getitem__(self, node):
+        return self._node[node]
+
+    def __iter__(self):
+        return iter(self._node)
+
+    def __len__(self):
+        return len(self._node)
+
+    def __contains__(self, node):
+        return node in self._node
+
+    def __call__(self, data=False):
+        return iter(self._node.items()) if data else iter(self._node)
@@ -1,5 +1,78 @@
+import inspect
+import weakref
+from collections import defaultdict
+from dataclasses import dataclass, field
+from functools import lru_cache
+from itertools import chain
 from pyvis.network import Network
-from io import StringIO
+from jinja2.utils import htmlsafe_json_dumps
+
+# node type -> (color, shape); edge label -> (color, dashed)
+NODE_STYLE = {
+    "file": ("#FFD700", "box"),
+    "class": ("#87CEEB", "box"),
+    "function": ("#7BE0AD", "ellipse"),
+    "variable": ("#FFA07A", "dot"),
+}
+DEFAULT_NODE_STYLE = ("#D3D3D3", "ellipse")
+
+EDGE_STYLE = {
+    "file_import": ("black", False),
+    "defined_in": ("#ff7f0e", False),
+    "has_method": ("#228B22", False),
+    "calls": ("#1f77b4", True),
+    "inherits": ("#6a0dad", True),
+    "defines_var": ("#FF6347", False),
+    "uses_var": ("#32CD32", True),
+    "mutates_var": ("#DC143C", False),
+    "param_type": ("#20B2AA", False),
+    "return_type": ("#9370DB", False),
+}
+DEFAULT_EDGE_STYLE = ("gray", False)
+
+_NET_KW = dict(width="100%", directed=True)
+_BH = dict(gravity=-8000, central_gravity=0.3, damping=0.5)
+
+def _barnes_hut(**springs):
+    """A hashable barnes_hut layout: _BH plus the layer's spring settings."""
+    return ("barnes_hut", tuple({**_BH, **springs}.items()))
+
+# layer -> what it shows and how it is laid out. node_types / edge_labels
+# of None mean "all"; an edge is only drawn if both ends are in the layer.
+LAYERS = {
+    "file": {
+        "height": "600px",
+        "node_types": ("file",),
+        "edge_labels": ("file_import",),
+        "titles": False,
+        "legend": False,
+        "layout": _barnes_hut(spring_length=250, spring_strength=0.001),
+    },
+    "class_method": {
+        "height": "800px",
+        "node_types": ("class", "function"),
+        "edge_labels": ("defined_in", "calls", "has_method", "inherits"),
+        "titles": True,
+        "legend": True,
+        "layout": _barnes_hut(spring_length=200, spring_strength=0.002),
+    },
+    "graph": {
+        "height": "800px",
+        "node_types": None,
+        "edge_labels": None,
+        "titles": True,
+        "legend": True,
+        "layout": ("repulsion", ()),
+    },
+    "semantic": {
+        "height": "800px",
+        "node_types": None,
+        "edge_labels": None,
+        "titles": False,
+        "legend": False,
+        "layout": _barnes_hut(spring_length=180, spring_strength=0.002),
+    },
+}
 
 def get_callers(graph, func_node):
     return list(graph.predecessors(func_node))
@@ -7,221 +80,240 @@ def get_callers(graph, func_node):
 def get_callees(graph, func_node):
     return list(graph.successors(func_node))
 
-def generate_file_layer(graph, node_types=None, edge_labels=None):
-    net = Network(height="600px", width="100%", directed=True)
-    for node, attrs in graph.nodes(data=True):
-        if attrs.get("type") != "file":
-            continue
-        net.add_node(node, label=attrs.get("display_name", node), color="#FFD700", shape="box")
-    
-    for src, dst, attrs in graph.edges(data=True):
-        if attrs.get("label") == "file_import":
-            net.add_edge(src, dst, color="black", title="file_import")
-    net.barnes_hut(gravity=-8000, central_gravity=0.3, spring_length=250, spring_strength=0.001, damping=0.5)
-    return net.generate_html()
-
-from pyvis.network import Network
-import streamlit.components.v1 as components
-
-from pyvis.network import Network
-
-def generate_class_method_layer(graph, node_types=None, edge_labels=None):
+@dataclass
+class GraphIndexes:
+    """Function lookups for main.process_query, built once per graph."""
+    functions_by_name: dict   # display_name -> function node ids, in graph order
+    functions_by_file: dict   # file -> function node ids, in graph order
+    position: dict            # function node id -> index in graph order
+    names: list               # functions_by_name keys, in the same order
+    trigrams: dict = None     # lowercased 3-char window -> set of indexes into names, built on first use
+    calls_out: dict = field(default_factory=dict)   # function node -> callees, filled on first ask
+    calls_in: dict = field(default_factory=dict)    # function node -> callers, filled on first ask
+
+    @classmethod
+    def build(cls, graph):
+        by_name, by_file, position = {}, {}, {}
+        for node, a in graph.nodes(data=True):
+            if a.get("type") != "function":
+                continue
+            position[node] = len(position)
+            by_name.setdefault(a.get("display_name", ""), []).append(node)
+            if a.get("file"):
+                by_file.setdefault(a["file"], []).append(node)
+        return cls(by_name, by_file, position, list(by_name))
+
+    def _build_trigrams(self):
+        trigrams = defaultdict(set)
+        for i, name in enumerate(self.names):
+            for gram in _trigrams(name.lower()):
+                trigrams[gram].add(i)
+        self.trigrams = dict(trigrams)
+
+    def find_function(self, func):
+        """First function, in graph order, whose display name contains func."""
+        # names are keyed in order of first appearance, so the first
+        # matching name holds the earliest matching node
+        grams = _trigrams(func.lower())
+        if not grams:                     # under 3 chars: nothing to prune with
+            candidates = range(len(self.names))
+        else:
+            if self.trigrams is None:
+                self._build_trigrams()
+            postings = [self.trigrams.get(gram) for gram in grams]
+            if not all(postings):
+                return None
+            postings.sort(key=len)
+            candidates = sorted(postings[0].intersection(*postings[1:]))
+        for i in candidates:
+            name = self.names[i]
+            if func in name:
+                return self.functions_by_name[name][0]
+        return None
+
+    def callees(self, graph, node):
+        """Targets of node's "calls" edges, in edge order."""
+        callees = self.calls_out.get(node)
+        if callees is None:
+            callees = self.calls_out[node] = tuple(
+                dst for _, dst, d in graph.out_edges(node, data=True) if d.get("label") == "calls"
+            )
+        return callees
+
+    def callers(self, graph, node):
+        """Sources of "calls" edges into node, in edge order."""
+        callers = self.calls_in.get(node)
+        if callers is None:
+            callers = self.calls_in[node] = tuple(
+                src for src, _, d in graph.in_edges(node, data=True) if d.get("label") == "calls"
+            )
+        return callers
+
+    def functions_in(self, file):
+        """Functions, in graph order, of every file whose path contains file."""
+        groups = [nodes for path, nodes in self.functions_by_file.items() if file in path]
+        if len(groups) == 1:
+            return groups[0]
+        return sorted(chain.from_iterable(groups), key=self.position.__getitem__)
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+# One GraphIndexes per loaded graph, dropped together with the graph
+_indexes = weakref.WeakKeyDictionary()
+
+def get_indexes(graph):
+    idx = _indexes.get(graph)
+    if idx is None:
+        idx = _indexes[graph] = GraphIndexes.build(graph)
+    return idx
+
+def get_doc(attrs, default=""):
+    """A node's docstring, cleaned (as by ast.get_docstring) only when it is shown."""
+    if "doc" not in attrs:
+        return default
+    doc = attrs["doc"]
+    return _clean_doc(doc) if doc else doc
+
+@lru_cache(maxsize=1024)
+def _clean_doc(doc):
+    return inspect.cleandoc(doc)
+
+def _render_html(height, nodes, edges, layout, legend_html=None):
     """
-    Generates a PyVis HTML graph for classes and methods.
-    Only includes nodes of type 'class' or 'function'.
-    Only includes edges where both nodes exist in the layer.
+    Build the pyvis page for one layer. nodes/edges are lists of
+    (id(s), ((option, value), ...)); main.layer_html caches the result.
     """
-
-    net = Network(height="800px", width="100%", directed=True)
-
-    # -----------------
-    # Add only class and function nodes
-    # -----------------
-    layer_nodes = set()
-    for node, attrs in graph.nodes(data=True):
-        if attrs.get("type") not in ["class", "function"]:
+    # Build the option dicts that Network.add_node / add_edge would;
+    # add_edge alone checks both ends against the node id list, which
+    # is quadratic on large graphs.
+    node_map = {}
+    for node, options in nodes:
+        if node in node_map:
             continue
+        options = dict(options)
+        label = options.pop("label", None) or node
+        shape = options.pop("shape", "dot")
+        color = options.pop("color", "#97c2fc")
+        node_map[node] = {"color": color, **options, "id": node, "label": label, "shape": shape}
+    node_list = list(node_map.values())
+    edge_list = [
+        {**dict(options), "from": src, "to": dst, "arrows": "to"}
+        for src, dst, options in edges
+    ]
+
+    # the same switches Network.generate_html derives from the data
+    tooltip_link = any("href" in (n.get("title") or "") for n in node_list)
+    head, middle, tail = _html_shell(height, layout, tooltip_link, len(node_list) > 100)
+    html = head + _tojson(node_list) + middle + _tojson(edge_list) + tail
+    if legend_html is None:
+        return html
 
-        label = attrs.get("display_name", node)
-        color = "#87CEEB" if attrs.get("type") == "class" else "#7BE0AD"
-        shape = "box" if attrs.get("type") == "class" else "ellipse"
-        title = (
-            f"{node}\n"
-            f"LOC: {attrs.get('loc','?')}\n"
-            f"Params: {attrs.get('params','[]')}\n"
-            f"Doc: {attrs.get('doc','')[:100]}"
-        )
-
-        net.add_node(node, label=label, color=color, shape=shape, title=title)
-        layer_nodes.add(node)
-
-    # -----------------
-    # Add only edges connecting existing nodes in this layer
-    # -----------------
-    for src, dst, attrs in graph.edges(data=True):
-        if attrs.get("label") not in ["defined_in", "calls", "has_method", "inherits"]:
-            continue
-
-        # Skip edges where either node is not in the layer
-        if src not in layer_nodes or dst not in layer_nodes:
-            continue
-
-        color = {
-            "calls": "#1f77b4",
-            "defined_in": "#ff7f0e",
-            "has_method": "#228B22",
-            "inherits": "#6a0dad"
-        }.get(attrs.get("label"), "black")
-
-        dashes = attrs.get("label") in ["calls", "inherits"]
-        net.add_edge(src, dst, color=color, dashes=dashes, title=attrs.get("label"))
-
-    # -----------------
-    # Layout/physics
-    # -----------------
-    net.barnes_hut(
-        gravity=-8000,
-        central_gravity=0.3,
-        spring_length=200,
-        spring_strength=0.002,
-        damping=0.5
-    )
-
-    # -----------------
-    # Legend
-    # -----------------
-    legend_html = """
-    <div style='font-size:14px; margin-top:10px; padding:10px; border-top:1px solid #ccc;'>
-        <b>Legend:</b><br>
-        <span style='color:#FFD700;'>■ File Node</span><br>
-        <span style='color:#87CEEB;'>■ Class Node</span><br>
-        <span style='color:#7BE0AD;'>● Function Node</span><br>
-        <span style='color:#ff7f0e;'>→ defined_in</span><br>
-        <span style='color:#228B22;'>→ has_method</span><br>
-        <span style='color:#1f77b4;'>⇢ calls</span><br>
-        <span style='color:#6a0dad;'>⇢ inherits</span>
-    </div>
-    """
-
-    html = net.generate_html()
+    # Append legend just before </body>
     if "</body>" in html:
         html = html.replace("</body>", legend_html + "\n</body>")
     else:
         html += legend_html
-
     return html
 
+def render_layer(graph, layer, node_types=None, edge_labels=None):
+    """
+    Generates the PyVis HTML for one of LAYERS, styled from NODE_STYLE and
+    EDGE_STYLE. node_types / edge_labels override the layer's own filters.
+    """
+    spec = LAYERS[layer]
+    node_types = node_types or spec["node_types"]
+    edge_labels = edge_labels or spec["edge_labels"]
 
-
-def generate_graph_html(graph):
-    net = Network(height="800px", width="100%", directed=True)
-
-    # --- Add nodes ---
+    # --- Nodes ---
+    nodes = []
     for node, attrs in graph.nodes(data=True):
-        node_type = attrs.get("type", "function")
-        label = attrs.get("display_name", node)
-        title = (
-            f"{node}\n"
-            f"LOC: {attrs.get('loc', '?')}\n"
-            f"Params: {attrs.get('params', '[]')}\n"
-            f"Doc: {attrs.get('doc', '')[:100]}"
-        )
-
-        if node_type == "file":
-            color = "#FFD700"
-            shape = "box"
-            
-        elif node_type == "class":
-            color = "#87CEEB"  # light blue
-            shape = "box"
-            
-        else:
-            color = "#7BE0AD"
-            shape = "ellipse"
-
-        net.add_node(node, label=label, title=title, color=color, shape=shape)
-
-    # --- Add edges ---
+        ntype = attrs.get("type")
+        if node_types and ntype not in node_types:
+            continue
+        color, shape = NODE_STYLE.get(ntype, DEFAULT_NODE_STYLE)
+        options = (("label", attrs.get("display_name", node)), ("color", color), ("shape", shape))
+        if spec["titles"]:
+            title = (
+                f"{node}\n"
+                f"LOC: {attrs.get('loc', '?')}\n"
+                f"Params: {attrs.get('params', '[]')}\n"
+                f"Doc: {get_doc(attrs)[:100]}"
+            )
+            options += (("title", title),)
+        nodes.append((node, options))
+
+    # --- Edges (only between nodes of this layer) ---
+    layer_nodes = {node for node, _ in nodes}
+    edges = []
     for src, dst, attrs in graph.edges(data=True):
         label = attrs.get("label", "")
-        if label == "calls":
-            color = "#1f77b4"
-            dashes = True
-        elif label == "defined_in":
-            color = "#ff7f0e"
-            dashes = False
-        else:
-            color = "black"
-            dashes = False
+        if edge_labels and label not in edge_labels:
+            continue
+        if src not in layer_nodes or dst not in layer_nodes:
+            continue
+        color, dashes = EDGE_STYLE.get(label, DEFAULT_EDGE_STYLE)
+        edges.append((src, dst, (("color", color), ("dashes", dashes), ("title", label))))
+
+    legend_html = _legend_html(node_types, edge_labels) if spec["legend"] else None
+    return _render_html(spec["height"], nodes, edges, spec["layout"], legend_html)
+
+def _legend_html(node_types, edge_labels):
+    rows = []
+    for ntype, (color, shape) in NODE_STYLE.items():
+        if not node_types or ntype in node_types:
+            mark = "■" if shape == "box" else "●"
+            rows.append(f"<span style='color:{color};'>{mark} {ntype.capitalize()} Node</span>")
+    for label, (color, dashes) in EDGE_STYLE.items():
+        if not edge_labels or label in edge_labels:
+            mark = "⇢" if dashes else "→"
+            rows.append(f"<span style='color:{color};'>{mark} {label}</span>")
+    return (
+        "\n    <div style='font-size:14px; margin-top:10px; padding:10px; border-top:1px solid #ccc;'>\n"
+        "        <b>Legend:</b><br>\n        "
+        + "<br>\n        ".join(rows)
+        + "\n    </div>\n    "
+    )
 
-        net.add_edge(src, dst, title=label, color=color, dashes=dashes)
+_NODES_MARK = {"id": "\0nodes\0"}
+_EDGES_MARK = {"id": "\0edges\0"}
 
-    # --- Layout ---
-    net.repulsion()
+def _tojson(data):
+    # what the template's |tojson filter emits (Jinja's default policy sorts keys)
+    return str(htmlsafe_json_dumps(data, sort_keys=True))
 
-    # --- Generate base HTML ---
-    html = net.generate_html()
-
-    # --- Add legend below graph ---
-    legend_html = """
-    <div style='font-size:14px; margin-top:10px; padding:10px; border-top:1px solid #ccc;'>
-        <b>Legend:</b><br>
-        <span style='color:#FFD700;'>■ File Node</span><br>
-        <span style='color:#87CEEB;'>■ Class Node</span><br>
-        <span style='color:#7BE0AD;'>● Function Node</span><br>
-        <span style='color:#ff7f0e;'>→ defined_in</span><br>
-        <span style='color:#1f77b4;'>⇢ calls</span>
-    </div>
+@lru_cache(maxsize=16)
+def _html_shell(height, layout, tooltip_link, many_nodes):
     """
+    pyvis's page for one layout, split around the nodes and edges JSON.
+    Network() compiles its Jinja template every time it is created; here
+    that happens once per combination of the template's switches, with
+    placeholder data, and _render_html() only splices in the real JSON.
+    """
+    net = Network(height=height, **_NET_KW)
+    method, kwargs = layout
+    getattr(net, method)(**dict(kwargs))
+    net.nodes = [dict(_NODES_MARK, title="href" if tooltip_link else "")] * (101 if many_nodes else 1)
+    net.edges = [_EDGES_MARK]
+    html = net.generate_html()
 
-    # Append legend just before </body>
-    if "</body>" in html:
-        html = html.replace("</body>", legend_html + "\n</body>")
-    else:
-        html += legend_html
-
-    return html
-
-def generate_full_semantic_layer(graph):
-    net = Network(height="800px", width="100%", directed=True)
+    head, rest = html.split(_tojson(net.nodes))
+    middle, tail = rest.split(_tojson(net.edges))
+    return head, middle, tail
 
-    # --- Nodes ---
-    for node, attrs in graph.nodes(data=True):
-        ntype = attrs.get("type")
-        label = attrs.get("display_name", node)
+def generate_file_layer(graph, node_types=None, edge_labels=None):
+    return render_layer(graph, "file", node_types, edge_labels)
 
-        color, shape = {
-            "file": ("#FFD700", "box"),
-            "class": ("#87CEEB", "box"),
-            "function": ("#7BE0AD", "ellipse"),
-            "variable": ("#FFA07A", "dot"),
-        }.get(ntype, ("#D3D3D3", "ellipse"))
+def generate_class_method_layer(graph, node_types=None, edge_labels=None):
+    """
+    Generates a PyVis HTML graph for classes and methods.
+    Only includes nodes of type 'class' or 'function'.
+    Only includes edges where both nodes exist in the layer.
+    """
+    return render_layer(graph, "class_method", node_types, edge_labels)
 
-        net.add_node(node, label=label, color=color, shape=shape)
+def generate_graph_html(graph):
+    return render_layer(graph, "graph")
 
-    # --- Edges ---
-    for src, dst, attrs in graph.edges(data=True):
-        label = attrs.get("label", "")
-        color = {
-            "defined_in": "#ff7f0e",
-            "has_method": "#228B22",
-            "calls": "#1f77b4",
-            "inherits": "#6a0dad",
-            "defines_var": "#FF6347",
-            "uses_var": "#32CD32",
-            "mutates_var": "#DC143C",
-            "param_type": "#20B2AA",
-            "return_type": "#9370DB",
-        }.get(label, "gray")
-
-        dashes = label in ["calls", "inherits", "uses_var"]
-        net.add_edge(src, dst, color=color, dashes=dashes, title=label)
-
-    net.barnes_hut(
-        gravity=-8000,
-        central_gravity=0.3,
-        spring_length=180,
-        spring_strength=0.002,
-        damping=0.5,
-    )
-    return net.generate_html()
+def generate_full_semantic_layer(graph):
+    return render_layer(graph, "semantic")
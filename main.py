@@ -1,14 +1,10 @@
 import os
+import re
 import streamlit as st
 import streamlit.components.v1 as components
 from dotenv import load_dotenv
-from code_parser import CodeParser
-from graph_utils import (
-    generate_file_layer,
-    generate_class_method_layer,
-    generate_graph_html,
-    generate_full_semantic_layer,
-)
+from code_parser import CodeParser, SKIP_DIRS, atomic_write, scan_py_files
+from graph_utils import render_layer, get_doc, get_indexes
 from chat_manager import (
     init_db,
     save_message,
@@ -18,31 +14,166 @@ from chat_manager import (
     delete_codebase,
 )
 import hashlib
+try:
+    import blake3                     # optional, much faster content hashing
+except ImportError:
+    blake3 = None
+try:
+    import pygit2                     # optional, clones in-process through libgit2
+except ImportError:
+    pygit2 = None
+import json
+import gzip
+import mmap
 import pickle
-import tempfile
+try:
+    import zstandard                  # optional, faster graph cache compression
+except ImportError:
+    zstandard = None
+import shutil
 import subprocess
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import networkx as nx
 
+CACHE_DIR = "cache"
+CLONE_DIR = os.path.join(CACHE_DIR, "clones")   # one reusable checkout per GitHub URL
+# The app's own files, never parsed even when they sit inside the codebase.
+OWN_DIRS = (CACHE_DIR,)
+# Per-file digest used by content hashing. Content-hash ids and manifests
+# are prefixed with it, so switching algorithms never mixes keys.
+FILE_HASH = "blake3" if blake3 else "sha256"
+# Graph caches are zstd-compressed when zstandard is installed, gzip otherwise.
+GRAPH_CACHE_EXT = ".pkl.zst" if zstandard else ".pkl.gz"
+# Part of the rendered layer file names; bump when graph_utils output changes.
+LAYER_HTML_VERSION = 1
+LAYER_VIEWS = {
+    "File Layer": "file",
+    "Class/Method Layer": "class_method",
+    "Full Semantic Layer": "semantic",
+}
+
 # ------------------------------------------------------------
 # Utility functions
 # ------------------------------------------------------------
-def hash_codebase(repo_path):
+def hash_codebase(repo_path, use_mtime=True):
+    """
+    Fingerprint a codebase for the graph cache key.
+    By default only (path, size, mtime) of each file is hashed, so no file
+    is read; use_mtime=False hashes file contents instead, for checkouts
+    whose mtimes cannot be trusted. Only the files CodeParser reads are
+    seen (see _parsed_files).
+    """
+    if not use_mtime:
+        return _hash_contents(repo_path)
     sha = hashlib.sha256()
-    for root, _, files in os.walk(repo_path):
-        for f in sorted(files):
-            file_path = os.path.join(root, f)
-            try:
-                with open(file_path, "rb") as file:
-                    while chunk := file.read(4096):
-                        sha.update(chunk)
-            except Exception:
-                pass
+    for rel, entry in _parsed_files(repo_path):
+        try:
+            st = entry.stat()
+        except OSError:
+            continue
+        sha.update(f"{rel}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
     return sha.hexdigest()
 
 
+def _hash_contents(repo_path):
+    """
+    Content fingerprint: "<FILE_HASH>-" + sha256 over sorted
+    (rel path, file digest) pairs.
+    Per-file digests are kept in a manifest (see _manifest_path) and reused
+    while a file's size, mtime and ctime are unchanged, so a reload only
+    reads the files that were touched. ctime cannot be set from user
+    space, so a file rewritten with its old mtime restored is still redone.
+    """
+    manifest_path = _manifest_path(repo_path)
+    old = _load_manifest(manifest_path)
+    new = {}
+    stale = []
+    for rel, entry in _parsed_files(repo_path):
+        try:
+            st = entry.stat()
+        except OSError:
+            continue
+        stamp = [st.st_size, st.st_mtime_ns, st.st_ctime_ns]
+        cached = old.get(rel)
+        if cached and cached[:3] == stamp:
+            new[rel] = cached
+        else:
+            new[rel] = stamp + [None]
+            stale.append((rel, entry.path))
+
+    # hashlib releases the GIL while digesting, so threads overlap the reads
+    if stale:
+        workers = min(32, (os.cpu_count() or 1) * 2)
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            digests = pool.map(_file_digest, [path for _, path in stale])
+            for (rel, _), digest in zip(stale, digests):
+                if digest is None:
+                    del new[rel]
+                else:
+                    new[rel][3] = digest
+
+    sha = hashlib.sha256()
+    for rel, (_, _, _, digest) in new.items():
+        sha.update(f"{rel}\0{digest}\n".encode())
+    if new != old:
+        _save_manifest(manifest_path, new)
+    return f"{FILE_HASH}-{sha.hexdigest()}"
+
+
+def _file_digest(path):
+    """Hex FILE_HASH digest of a file's content, or None if it cannot be read."""
+    new_hash = blake3.blake3 if blake3 else hashlib.sha256
+    try:
+        with open(path, "rb", buffering=0) as file:
+            if hasattr(hashlib, "file_digest"):   # Python 3.11+: read/update loop runs in C
+                return hashlib.file_digest(file, new_hash).hexdigest()
+            h = new_hash()
+            while chunk := file.read(1 << 20):
+                h.update(chunk)
+            return h.hexdigest()
+    except OSError:
+        return None
+
+
+def _manifest_path(repo_path):
+    # keyed by the checkout's location: its codebase id is what is being computed
+    key = hashlib.sha256(os.path.abspath(repo_path).encode()).hexdigest()[:32]
+    return os.path.join(CACHE_DIR, "manifests", f"{FILE_HASH}-{key}.json")
+
+
+def _load_manifest(manifest_path):
+    try:
+        with open(manifest_path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_manifest(manifest_path, manifest):
+    try:
+        atomic_write(manifest_path, json.dumps(manifest))
+    except OSError:
+        pass
+
+
+def _parsed_files(repo_path):
+    """(rel path, DirEntry) for every file CodeParser reads, sorted by path."""
+    return sorted(((rel, entry) for entry, rel in scan_py_files(repo_path, OWN_DIRS)), key=lambda item: item[0])
+
+
+# One lock per clone slot, shared by every session of this process, so two
+# loads of the same URL never fetch into or replace one checkout at once.
+@st.cache_resource(show_spinner=False)
+def _slot_lock(slot):
+    return threading.Lock()
+
+
 def get_local_repo_path(path_or_url):
     """
-    If input is a GitHub URL, clone it to a temporary dir.
+    If input is a GitHub URL, clone it under CLONE_DIR, or update the
+    clone made by an earlier load of the same URL.
     Otherwise, return absolute local path.
     """
     if not path_or_url:
@@ -52,52 +183,213 @@ def get_local_repo_path(path_or_url):
     if path_or_url.startswith(("http://", "https://")):
         if "github.com" not in path_or_url:
             raise ValueError("Only GitHub URLs are supported.")
-        tmp_dir = tempfile.mkdtemp(prefix="repo_")
-        with st.spinner("Cloning GitHub repository..."):
+        slot = os.path.abspath(
+            os.path.join(CLONE_DIR, hashlib.sha1(path_or_url.encode()).hexdigest())
+        )
+        with st.spinner("Cloning GitHub repository..."), _slot_lock(slot):
+            if os.path.isdir(os.path.join(slot, ".git")):
+                try:
+                    # reset only rewrites files that changed, so the others
+                    # keep their mtimes and the codebase id stays put
+                    _git("-C", slot, "fetch", "--depth=1", "--no-tags", "origin")
+                    _git("-C", slot, "reset", "--hard", "FETCH_HEAD")
+                    return slot
+                except subprocess.CalledProcessError:
+                    pass  # unusable clone: start over
+            os.makedirs(CLONE_DIR, exist_ok=True)
+            # clone next to the slot and swap it in, so the old checkout is
+            # never half deleted under a reader
+            tmp = tempfile.mkdtemp(dir=CLONE_DIR, suffix=".tmp")
             try:
-                subprocess.run(
-                    ["git", "clone", path_or_url, tmp_dir],
-                    check=True,
-                    stdout=subprocess.DEVNULL,
-                    stderr=subprocess.DEVNULL,
-                )
+                # only the latest tree is parsed, so skip history and tags
+                _clone(path_or_url, tmp)
             except subprocess.CalledProcessError as e:
-                import shutil
-                shutil.rmtree(tmp_dir, ignore_errors=True)
+                shutil.rmtree(tmp, ignore_errors=True)
                 raise ValueError("Failed to clone repository.") from e
-        return tmp_dir
+            trash = None
+            if os.path.lexists(slot):
+                trash = tempfile.mkdtemp(dir=CLONE_DIR, suffix=".old")
+                os.replace(slot, os.path.join(trash, "slot"))
+            os.replace(tmp, slot)
+            if trash:
+                shutil.rmtree(trash, ignore_errors=True)
+        return slot
     if not os.path.exists(path_or_url):
         raise ValueError(f"Local path not found: {path_or_url}")
     return os.path.abspath(path_or_url)
 
 
+def _clone(url, dest):
+    """Shallow clone of url into dest, with pygit2 unless USE_PYGIT2=0, else (or on failure) the git CLI."""
+    if pygit2 is not None and os.environ.get("USE_PYGIT2", "1") != "0":
+        try:
+            pygit2.clone_repository(url, dest, depth=1)
+            return
+        except (pygit2.GitError, TypeError):   # TypeError: pygit2 < 1.14 has no depth
+            shutil.rmtree(dest, ignore_errors=True)
+    _git("clone", "--depth=1", "--single-branch", "--no-tags", url, dest)
+
+
+def _git(*args):
+    """Run git and return its stdout (bytes)."""
+    # no prompt, so private repos fail instead of hanging
+    return subprocess.run(
+        ["git", *args],
+        check=True,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        env={**os.environ, "GIT_TERMINAL_PROMPT": "0"},
+    ).stdout
+
+
+def git_codebase_id(repo_path):
+    """"git-<HEAD sha>", plus "-dirty-<hash>" when files the parser reads differ from HEAD; None outside a checkout."""
+    if not os.path.exists(os.path.join(repo_path, ".git")):
+        return None
+    # no *.py pathspec: it would hide the directory entries git reports for
+    # submodules and nested checkouts, whose files CodeParser still reads
+    pathspecs = [f":(exclude,glob)**/{d}/**" for d in sorted(SKIP_DIRS)]
+    for own in OWN_DIRS:
+        rel = os.path.relpath(os.path.abspath(own), os.path.abspath(repo_path))
+        if not rel.startswith(os.pardir):
+            pathspecs.append(f":(exclude,literal){rel}")
+    try:
+        head = _git("-C", repo_path, "rev-parse", "HEAD").decode().strip()
+        status = _git("--no-optional-locks", "-C", repo_path, "status",
+                      "--porcelain", "-z", "--untracked-files=all",
+                      "--ignored=traditional", "--ignore-submodules=none",
+                      "--", *pathspecs)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+    sha = hashlib.sha256()
+    dirty = False
+    entries = iter(status.split(b"\0"))
+    for entry in entries:
+        if not entry:
+            continue
+        if entry[0] in b"RC":
+            next(entries, None)               # rename/copy source path follows
+        rel = os.fsdecode(entry[3:]).rstrip("/")
+        path = os.path.join(repo_path, rel)
+        if os.path.isdir(path):               # submodule or nested checkout
+            files = [(os.path.join(rel, sub), e) for e, sub in scan_py_files(path, OWN_DIRS)]
+        elif rel.endswith(".py"):
+            files = [(rel, None)]
+        else:
+            continue
+        dirty = True
+        # the status code covers deletions; (size, mtime) a second edit
+        # to an already modified file
+        sha.update(entry[:2] + b"\0" + entry[3:] + b"\n")
+        for file_rel, dir_entry in files:
+            try:
+                st = dir_entry.stat() if dir_entry else os.stat(os.path.join(repo_path, file_rel))
+            except OSError:
+                continue
+            sha.update(f"{file_rel}\0{st.st_size}\0{st.st_mtime_ns}\n".encode())
+    if not dirty:
+        return f"git-{head}"
+    return f"git-{head}-dirty-{sha.hexdigest()[:16]}"
+
+
 def load_or_parse_graph(repo_path):
     """
     Returns (codebase_id, graph, parsed_flag).
     parsed_flag=True if freshly parsed, else loaded from cache.
     """
-    codebase_id = hash_codebase(repo_path)
-    os.makedirs("cache", exist_ok=True)
-    cache_file = os.path.join("cache", f"{codebase_id}.pkl")
-
-    if os.path.exists(cache_file):
-        try:
-            with open(cache_file, "rb") as f:
-                graph = pickle.load(f)
-            return codebase_id, graph, False
-        except Exception:
-            pass  # fall through to reparse
+    # HASH_CONTENTS=1 for checkouts whose mtimes cannot be trusted; the git
+    # id is skipped too, as its dirty part is built from mtimes
+    use_mtime = os.environ.get("HASH_CONTENTS", "0") == "0"
+    codebase_id = (use_mtime and git_codebase_id(repo_path)) or hash_codebase(repo_path, use_mtime)
+    graph, parsed = _graph_for(codebase_id, repo_path)
+    return codebase_id, graph, parsed
+
+
+# Graphs are kept in memory per process, keyed by codebase id only, so
+# reloading a codebase on a rerun skips the disk cache entirely; a hit
+# returns the flag from when the graph was first loaded.
+@st.cache_resource(show_spinner=False, max_entries=8)
+def _graph_for(codebase_id, _repo_path):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    cache_base = os.path.join(CACHE_DIR, codebase_id)
+    cache_file = cache_base + GRAPH_CACHE_EXT
+
+    # plain .pkl: uncompressed caches written by older versions
+    for path in (cache_file, cache_base + ".pkl"):
+        if os.path.exists(path):
+            try:
+                return _load_graph(path), False
+            except Exception:
+                pass  # fall through to reparse
 
-    parser = CodeParser(repo_path)
+    parser = CodeParser(_repo_path, exclude_dirs=OWN_DIRS)
     graph = parser.parse()
-    with open(cache_file, "wb") as f:
-        pickle.dump(graph, f)
-    return codebase_id, graph, True
+    _store_graph(cache_file, graph)
+    return graph, True
+
+
+# Rendering a large layer takes a few hundred ms, and Streamlit reruns
+# main() on every interaction; keep each layer's HTML in memory and on
+# disk, keyed by the id the graph was loaded under.
+@st.cache_resource(show_spinner=False, max_entries=32)
+def layer_html(graph_id, layer, _graph):
+    path = os.path.join(CACHE_DIR, f"{graph_id}-{layer}-v{LAYER_HTML_VERSION}.html")
+    try:
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+    except OSError:
+        pass
+    html = render_layer(_graph, layer)
+    try:
+        atomic_write(path, html)
+    except OSError:
+        pass
+    return html
+
+
+def _load_graph(path):
+    # the file is mapped rather than read, so its bytes are paged in by the
+    # OS as they are consumed instead of being copied onto the heap first
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if path.endswith(".zst"):
+            with zstandard.ZstdDecompressor().stream_reader(mm) as reader:
+                return pickle.load(reader)
+        if path.endswith(".gz"):
+            return pickle.loads(gzip.decompress(mm))
+        return pickle.loads(mm)
+
+
+def _store_graph(path, graph):
+    # level 1 gzip: ~4x smaller for about the cost of pickling; the
+    # redundancy is mostly repeated paths, labels and docstring text.
+    # The pickle is streamed through the compressor frame by frame, so
+    # the uncompressed bytes are never held in memory all at once.
+    def write(f):
+        if zstandard:
+            writer = zstandard.ZstdCompressor(level=3).stream_writer(f)
+        else:
+            writer = gzip.GzipFile(fileobj=f, mode="wb", compresslevel=1)
+        with writer:
+            pickle.dump(graph, writer, protocol=pickle.HIGHEST_PROTOCOL)
+
+    atomic_write(path, write)
 
 
 # ------------------------------------------------------------
 # Query processor
 # ------------------------------------------------------------
+# One match picks the query kind and captures its argument. Alternatives
+# are tried in the order the kinds are listed in process_query; keywords
+# match in any case, captures keep the query's own case.
+_QUERY_RE = re.compile(
+    r"(?is)(?=show info for|details of)(?:.*\s)?(?P<info>\S+)"   # last word
+    r"|(?=functions in).*functions in\s*(?P<file>.*)"           # after the last "functions in"
+    r"|(?=(?:.*\s)?calls(?:\s|\Z))(?P<caller>\S+)"              # first word, "calls" is a word
+    r"|(?P<callee>.*?)called by"                                # before the first "called by"
+)
+
+
 def process_query(graph, query):
     """
     Mini NLQ processor:
@@ -109,74 +401,56 @@ def process_query(graph, query):
     if not graph:
         return "No codebase graph loaded."
 
-    q = (query or "").lower().strip()
-    if not q:
+    text = (query or "").strip()
+    if not text:
         return "Empty query."
+    m = _QUERY_RE.match(text)
+    if m is None:
+        return "Query not understood. Try: 'show info for foo', 'functions in file.py', 'foo calls', 'foo called by'."
+    idx = get_indexes(graph)
 
     # --- function info ---
-    if q.startswith("show info for") or q.startswith("details of"):
-        func = query.split()[-1].replace("()", "").strip()
-        matches = [
-            n
-            for n, a in graph.nodes(data=True)
-            if a.get("type") == "function" and func in a.get("display_name", "")
-        ]
-        if not matches:
+    if m["info"] is not None:
+        func = m["info"].replace("()", "").strip()
+        node = idx.find_function(func)
+        if node is None:
             return f"No function named '{func}' found."
-        node = matches[0]
         a = graph.nodes[node]
         return (
             f"### {a.get('display_name')}\n"
             f"**File:** {a.get('file','?')}\n"
             f"**LOC:** {a.get('loc','?')}\n"
             f"**Params:** {a.get('params','[]')}\n"
-            f"**Docstring:** {a.get('doc','(none)')}"
+            f"**Docstring:** {get_doc(a, '(none)')}"
         )
 
     # --- list functions in file ---
-    if q.startswith("functions in"):
-        file = query.split("functions in")[-1].strip()
-        matches = [
-            n for n, a in graph.nodes(data=True)
-            if a.get("type") == "function" and a.get("file") and file in a.get("file")
-        ]
+    if m["file"] is not None:
+        file = m["file"]
+        matches = idx.functions_in(file)
         if not matches:
             return f"No functions found in file '{file}'."
         return "Functions:\n" + "\n".join(f"- {graph.nodes[m]['display_name']}" for m in matches)
 
     # --- calls / called by ---
-    tokens = q.split()
-    if "calls" in tokens:
-        func = tokens[0].replace("()", "")
-        matches = [n for n, a in graph.nodes(data=True)
-                   if a.get("type") == "function" and func in a.get("display_name", "")]
-        if not matches:
+    if m["caller"] is not None:
+        func = m["caller"].lower().replace("()", "")
+        func_node = idx.find_function(func)
+        if func_node is None:
             return f"No function matching '{func}' found."
-        func_node = matches[0]
-        callees = [
-            dst for _, dst, d in graph.out_edges(func_node, data=True)
-            if d.get("label") == "calls"
-        ]
+        callees = idx.callees(graph, func_node)
         if not callees:
             return f"'{func}' does not call any other function."
         return f"'{func}' calls:\n" + "\n".join(f"- {graph.nodes[c]['display_name']}" for c in callees)
 
-    if "called by" in q:
-        func = q.split("called by")[0].strip().replace("()", "")
-        matches = [n for n, a in graph.nodes(data=True)
-                   if a.get("type") == "function" and func in a.get("display_name", "")]
-        if not matches:
-            return f"No function matching '{func}' found."
-        func_node = matches[0]
-        callers = [
-            src for src, _, d in graph.in_edges(func_node, data=True)
-            if d.get("label") == "calls"
-        ]
-        if not callers:
-            return f"'{func}' is not called by any function."
-        return f"'{func}' is called by:\n" + "\n".join(f"- {graph.nodes[c]['display_name']}" for c in callers)
-
-    return "Query not understood. Try: 'show info for foo', 'functions in file.py', 'foo calls', 'foo called by'."
+    func = m["callee"].lower().strip().replace("()", "")
+    func_node = idx.find_function(func)
+    if func_node is None:
+        return f"No function matching '{func}' found."
+    callers = idx.callers(graph, func_node)
+    if not callers:
+        return f"'{func}' is not called by any function."
+    return f"'{func}' is called by:\n" + "\n".join(f"- {graph.nodes[c]['display_name']}" for c in callers)
 
 
 # ------------------------------------------------------------
@@ -200,6 +474,7 @@ def main():
             codebase_id, graph, parsed = load_or_parse_graph(repo_path)
             register_codebase(codebase_id, os.path.basename(repo_path), repo_path)
             st.session_state["graph"] = graph
+            st.session_state["graph_id"] = codebase_id
             st.session_state["codebase_id"] = codebase_id
             st.sidebar.success(f"Loaded: {os.path.basename(repo_path)}")
         except Exception as e:
@@ -215,8 +490,9 @@ def main():
         )
         if st.sidebar.button("Load Selected"):
             cid, name, path = selected
-            _, graph, _ = load_or_parse_graph(path)
+            graph_id, graph, _ = load_or_parse_graph(path)
             st.session_state["graph"] = graph
+            st.session_state["graph_id"] = graph_id
             st.session_state["codebase_id"] = cid
             st.sidebar.success(f"Loaded cached: {name}")
 
@@ -235,17 +511,12 @@ def main():
         st.subheader("Visualization Layers")
         layer = st.radio(
             "Select layer view:",
-            ["File Layer", "Class/Method Layer", "Full Semantic Layer"],
+            list(LAYER_VIEWS),
             horizontal=True,
         )
 
         with st.spinner("Rendering graph..."):
-            if layer == "File Layer":
-                html = generate_file_layer(graph)
-            elif layer == "Class/Method Layer":
-                html = generate_class_method_layer(graph)
-            else:
-                html = generate_full_semantic_layer(graph)
+            html = layer_html(st.session_state["graph_id"], LAYER_VIEWS[layer], graph)
             components.html(html, height=850, scrolling=True)
 
     # --------------------------------------------------------